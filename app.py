@@ -7,14 +7,43 @@
 
 import os
 import re
+import json
 import time
-import requests
+import asyncio
+import hashlib
+import email.utils
+import threading
+import diskcache
+import httpx
 import streamlit as st
 import zipfile
 from pathlib import Path
 from io import BytesIO
 from typing import List, Tuple, Optional, Dict
 
+# 优先使用更快的orjson，未安装时退回标准库json
+try:
+    import orjson
+
+    def json_dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    json_loads = json.loads
+
+# 语义缓存为可选功能，需要额外安装 fastembed 和 faiss-cpu
+try:
+    import faiss
+    import numpy as np
+    from fastembed import TextEmbedding
+    SEMANTIC_CACHE_AVAILABLE = True
+except ImportError:
+    SEMANTIC_CACHE_AVAILABLE = False
+
 # 页面配置
 st.set_page_config(
     page_title="对话翻译工具",
@@ -27,99 +56,369 @@ MODEL_NAME = "google/gemini-2.5-flash"
 API_URL = "https://openrouter.ai/api/v1/chat/completions"
 MAX_FILES = 5
 MAX_TOKENS = 200000  # 提升到20万tokens
+CHARS_PER_TOKEN = 3  # 粗略估算：约3个字符 ≈ 1 token
+OUTPUT_TOKEN_RATIO = 2.2  # 输出包含原文+译文，约为输入的2倍多
+OUTPUT_TOKEN_MARGIN = 1024
+REASONING_MAX_TOKENS = 1024  # 思考型模型的推理tokens也计入max_tokens，限制其用量并单独预留
+
+# 请求配置
+REQUEST_TIMEOUT = 120  # 秒
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.5  # 秒，每次重试翻倍
+MAX_RETRY_AFTER = 30  # 秒，服务端要求的等待时间上限
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# 流式预览配置
+STREAM_REFRESH_INTERVAL = 0.5  # 秒
+STREAM_PREVIEW_CHARS = 2000  # 预览只显示最新的内容，避免每次刷新传输全文
+
+# 缓存配置
+CACHE_DIR = ".cache/translations"
+PROMPT_VERSION = "v2"  # 修改提示词后需递增，避免命中旧翻译
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+SEMANTIC_THRESHOLD = 0.92  # 余弦相似度和整文件行重合度都达到该值才复用已有翻译
+SEMANTIC_MAX_ENTRIES = 50  # 每个会话最多保留的语义缓存条数
+
+# 预编译正则
+_TAG_RE = re.compile(r'\[[^\]\n]*\]')  # [tag]语气标签（不跨行）
+
+# 系统提示词：翻译要求固定放在system消息中，文件内容单独作为user消息
+_SYSTEM_PROMPT = """请将用户发送的英文对话文件翻译成地道的中文，要符合中文表达习惯，准确传达原意。
+
+要求：
+1. 保持原文件的格式和结构
+2. 每行对话格式为"说话者: 内容"
+3. 先显示英文原文，然后显示中文翻译，每组对话之间空一行
+4. 自动清理已经存在的[tag]标签
+5. 翻译要准确、地道、符合中文表达习惯
+6. 输出格式示例：
+
+Sally: Hello there!
+Sally: 你好！
+
+Pete: How are you?
+Pete: 你好吗？
+
+只输出翻译结果，不要添加任何说明。"""
+
+
+def estimate_tokens(char_count: int) -> int:
+    """粗略估算token数量，文件列表和超长检查共用"""
+    return char_count // CHARS_PER_TOKEN
+
+
+class TranslationError(Exception):
+    """文件无法翻译（如超出长度上限、译文被截断），不计入翻译结果"""
+
+
+class TextEmbedder:
+    """文本嵌入模型 - 所有会话共用，第一次计算向量时才加载"""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL):
+        self.model_name = model_name
+        self.model = None
+        self.lock = threading.Lock()
+
+    def embed(self, text: str) -> "np.ndarray":
+        """计算归一化后的文本向量（内积即余弦相似度）"""
+        with self.lock:
+            if self.model is None:
+                self.model = TextEmbedding(model_name=self.model_name)
+        vector = np.asarray(next(iter(self.model.embed([text]))), dtype='float32').reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+
+class SemanticCache:
+    """语义缓存 - 内容相近的文件直接复用已有翻译（仅限当前会话）"""
+
+    def __init__(self, embedder: TextEmbedder, max_entries: int = SEMANTIC_MAX_ENTRIES):
+        self.embedder = embedder
+        self.max_entries = max_entries
+        self.index = None
+        self.entries: List[Tuple["np.ndarray", frozenset, str]] = []  # (向量, 原文行集合, 翻译结果)
+        self.lock = threading.Lock()
+
+    def embed(self, text: str) -> "np.ndarray":
+        return self.embedder.embed(text)
+
+    @staticmethod
+    def line_set(text: str) -> frozenset:
+        """原文的非空行集合，用于确认整个文件都相近"""
+        return frozenset(line.strip() for line in text.split('\n') if line.strip())
+
+    def lookup(self, vector: "np.ndarray", lines: frozenset, threshold: float) -> Optional[str]:
+        """查找最相近的已翻译内容，相似度不足时返回None"""
+        with self.lock:
+            if self.index is None or self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(vector, 1)
+            _, cached_lines, translation = self.entries[ids[0][0]]
+
+        if scores[0][0] < threshold:
+            return None
+
+        # 嵌入模型只看文件开头，开头相同的不同文件也会高分，再用整文件的行重合度确认
+        union = len(lines | cached_lines)
+        if not union or len(lines & cached_lines) / union < threshold:
+            return None
+        return translation
+
+    def add(self, vector: "np.ndarray", lines: frozenset, translation: str):
+        """加入新的翻译结果，超出上限时丢弃最早的条目"""
+        with self.lock:
+            self.entries.append((vector, lines, translation))
+            if len(self.entries) > self.max_entries:
+                self.entries = self.entries[-self.max_entries:]
+                self.index = None
+
+            if self.index is None:
+                self.index = faiss.IndexFlatIP(vector.shape[1])
+                self.index.add(np.vstack([entry[0] for entry in self.entries]))
+            else:
+                self.index.add(vector)
+
+    def clear(self):
+        """清空语义缓存"""
+        with self.lock:
+            self.index = None
+            self.entries = []
+
+
+@st.cache_resource
+def get_translation_cache() -> diskcache.Cache:
+    """获取磁盘翻译缓存（跨会话、跨线程共享）"""
+    return diskcache.Cache(CACHE_DIR)
+
+
+@st.cache_resource
+def get_text_embedder() -> TextEmbedder:
+    """获取共用的嵌入模型（按需加载）"""
+    return TextEmbedder()
+
+
+def get_semantic_cache() -> SemanticCache:
+    """获取当前会话的语义缓存，不同用户之间互不共享"""
+    if 'semantic_cache' not in st.session_state:
+        st.session_state['semantic_cache'] = SemanticCache(get_text_embedder())
+    return st.session_state['semantic_cache']
 
 
 class DialogueTranslator:
     """对话翻译器类 - 终极优化版"""
 
-    def __init__(self, api_key: str, model: str):
+    def __init__(self, api_key: str, model: str, cache: Optional[diskcache.Cache] = None,
+                 semantic_cache: Optional[SemanticCache] = None,
+                 semantic_threshold: float = SEMANTIC_THRESHOLD):
         self.api_key = api_key
         self.model = model
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        self.semantic_threshold = semantic_threshold
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
 
+    def create_client(self) -> httpx.AsyncClient:
+        """创建HTTP/2客户端，同一批文件的请求在一个连接上多路复用"""
+        # 不传自定义transport，保留对HTTPS_PROXY/ALL_PROXY等代理环境变量的支持
+        return httpx.AsyncClient(
+            headers=self.headers,
+            http2=True,
+            limits=httpx.Limits(max_connections=MAX_FILES),
+            timeout=REQUEST_TIMEOUT
+        )
+
+    async def post_with_retry(self, client: httpx.AsyncClient, payload: Dict, stream: bool) -> httpx.Response:
+        """发送请求，遇到连接/协议错误、限流或服务端错误时退避重试"""
+        request = client.build_request("POST", API_URL, content=json_dumps(payload))
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = await client.send(request, stream=stream)
+            except httpx.TransportError:
+                # 所有文件共用一个HTTP/2连接，连接断开（如GOAWAY）时每个文件都要能重试
+                if attempt == MAX_RETRIES:
+                    raise
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                return response
+            await response.aclose()
+            await asyncio.sleep(self.get_retry_delay(response, attempt))
+
+    def get_retry_delay(self, response: httpx.Response, attempt: int) -> float:
+        """优先按服务端的Retry-After等待（秒数或HTTP日期），否则指数退避"""
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0.0), MAX_RETRY_AFTER)
+        return RETRY_BACKOFF * 2 ** attempt
+
     def clean_tags_from_content(self, content: str) -> str:
         """清理整个内容中的[tag]语气标签"""
-        return re.sub(r'\[.*?\]', '', content)
+        return _TAG_RE.sub('', content)
 
-    def translate_entire_file(self, content: str, filename: str) -> str:
+    def get_cache_key(self, cleaned_content: str) -> str:
+        """根据模型、提示词版本和文件内容生成缓存键"""
+        return hashlib.sha256(f"{self.model}|{PROMPT_VERSION}|{cleaned_content}".encode('utf-8')).hexdigest()
+
+    async def translate_entire_file(self, client: httpx.AsyncClient, content: str, filename: str,
+                                    stream_callback=None) -> Tuple[str, Optional[Dict], bool]:
         """
-        一次性翻译整个文件内容
+        一次性翻译整个文件内容，返回(译文, token用量, 是否来自缓存)
+        缓存命中或请求失败时token用量为None
+        文件无法翻译时抛出TranslationError
+        传入stream_callback时使用流式响应，每收到一段译文就回调一次
         """
         # 先清理标签
         cleaned_content = self.clean_tags_from_content(content)
 
-        # 构建提示词
-        prompt = f"""请将以下英文对话文件翻译成地道的中文，要符合中文表达习惯，准确传达原意。
-
-要求：
-1. 保持原文件的格式和结构
-2. 每行对话格式为"说话者: 内容"
-3. 先显示英文原文，然后显示中文翻译，每组对话之间空一行
-4. 自动清理已经存在的[tag]标签
-5. 翻译要准确、地道、符合中文表达习惯
-6. 输出格式示例：
-
-Sally: Hello there!
-Sally: 你好！
-
-Pete: How are you?
-Pete: 你好吗？
-
-原文件内容：
-{cleaned_content}
-
-翻译结果："""
+        # 明显超出上限的文件直接拒绝，不浪费一次API请求
+        estimated_tokens = estimate_tokens(len(cleaned_content))
+        if estimated_tokens > MAX_TOKENS:
+            raise TranslationError(f"文件过长，请拆分: 约{estimated_tokens:,} tokens，上限{MAX_TOKENS:,}")
+
+        # 相同内容直接返回缓存结果，不再重复请求API
+        cache_key = self.get_cache_key(cleaned_content)
+        if self.cache is not None:
+            cached_content = self.cache.get(cache_key)
+            if cached_content is not None:
+                return cached_content, None, True
+
+        # 精确缓存未命中时，再查找内容相近的已翻译文件
+        vector = None
+        if self.semantic_cache is not None:
+            # 计算向量是CPU密集操作，放到线程里避免阻塞其他文件的请求
+            vector = await asyncio.to_thread(self.semantic_cache.embed, cleaned_content)
+            lines = self.semantic_cache.line_set(cleaned_content)
+            cached_content = self.semantic_cache.lookup(vector, lines, self.semantic_threshold)
+            if cached_content is not None:
+                return cached_content, None, True
 
         # 调用API
         payload = {
             "model": self.model,
             "messages": [
+                {
+                    "role": "system",
+                    "content": _SYSTEM_PROMPT
+                },
                 {
                     "role": "user",
-                    "content": prompt
+                    "content": cleaned_content
                 }
             ],
             "temperature": 0.3,
-            "max_tokens": MAX_TOKENS
+            # 按文件大小估算输出上限，避免服务端按20万tokens预留资源
+            "max_tokens": min(
+                MAX_TOKENS,
+                int(estimated_tokens * OUTPUT_TOKEN_RATIO) + OUTPUT_TOKEN_MARGIN + REASONING_MAX_TOKENS
+            ),
+            "reasoning": {"max_tokens": REASONING_MAX_TOKENS},
+            "provider": {"sort": "latency"},  # OpenRouter优先选择低延迟的服务商
+            "usage": {"include": True}  # 返回实际token用量
         }
+        if stream_callback:
+            payload["stream"] = True
 
         try:
-            response = requests.post(
-                API_URL,
-                headers=self.headers,
-                json=payload,
-                timeout=120  # 增加超时时间
-            )
-            response.raise_for_status()
+            response = await self.post_with_retry(client, payload, stream=bool(stream_callback))
+            try:
+                response.raise_for_status()
 
-            result = response.json()
-            translated_content = result['choices'][0]['message']['content'].strip()
+                if stream_callback:
+                    translated_content, usage, finish_reason = await self.read_stream(response, stream_callback)
+                    translated_content = translated_content.strip()
+                else:
+                    result = json_loads(response.content)
+                    choice = result['choices'][0]
+                    finish_reason = choice.get('finish_reason')
+                    usage = result.get('usage')
+                    # 输出被截断时content可能为null
+                    translated_content = (choice['message'].get('content') or '').strip()
+            finally:
+                await response.aclose()
+
+            # 达到max_tokens被截断的译文不完整，既不缓存也不算成功
+            if finish_reason == "length":
+                raise TranslationError(f"译文被截断（达到 {payload['max_tokens']:,} tokens 输出上限）")
+
+            if self.cache is not None:
+                self.cache.set(cache_key, translated_content)
+            if self.semantic_cache is not None:
+                self.semantic_cache.add(vector, lines, translated_content)
+
+            return translated_content, usage, False
+
+        except httpx.HTTPError as e:
+            return f"[API请求失败: {str(e)}]", None, False
+        except (KeyError, IndexError, ValueError) as e:
+            return f"[解析响应失败: {str(e)}]", None, False
+
+    async def read_stream(self, response: httpx.Response,
+                          stream_callback) -> Tuple[str, Optional[Dict], Optional[str]]:
+        """读取SSE流式响应，返回(完整译文, token用量, 结束原因)"""
+        chunks = []
+        usage = None
+        finish_reason = None
+        async for line in response.aiter_lines():
+            # 跳过空行和": OPENROUTER PROCESSING"之类的注释行
+            if not line.startswith("data: "):
+                continue
+            data = line[6:]
+            if data == "[DONE]":
+                break
 
-            return translated_content
+            chunk = json_loads(data)
+            error = chunk.get('error')
+            if error:
+                raise ValueError(error.get('message', error) if isinstance(error, dict) else error)
 
-        except requests.exceptions.RequestException as e:
-            return f"[API请求失败: {str(e)}]"
-        except (KeyError, IndexError) as e:
-            return f"[解析响应失败: {str(e)}]"
+            # 最后一个数据块附带token用量
+            if chunk.get('usage'):
+                usage = chunk['usage']
+
+            choices = chunk.get('choices')
+            if not choices:
+                continue
+
+            # 结束原因在最后一个带choices的数据块里
+            if choices[0].get('finish_reason'):
+                finish_reason = choices[0]['finish_reason']
+
+            delta = choices[0].get('delta', {}).get('content')
+            if delta:
+                chunks.append(delta)
+                stream_callback(delta)
+
+        return ''.join(chunks), usage, finish_reason
 
     def count_dialogues(self, content: str) -> int:
         """统计对话行数"""
-        lines = content.split('\n')
         count = 0
-        for line in lines:
-            line = line.strip()
-            if line and ':' in line:
-                # 简单判断是否为对话格式
-                if re.match(r'^[^:]+:\s*.+$', line):
-                    count += 1
+        for line in content.split('\n'):
+            sep = line.find(':')
+            if sep <= 0:
+                continue
+            # 冒号前后都有非空白内容才算对话行
+            if line[:sep].strip() and line[sep + 1:].strip():
+                count += 1
         return count
 
-    def process_content(self, content: str, filename: str, progress_callback=None) -> Tuple[str, str, int]:
+    async def process_content(self, client: httpx.AsyncClient, content: str, filename: str,
+                              progress_callback=None,
+                              stream_callback=None) -> Tuple[str, str, int, Optional[Dict], bool]:
         """
-        处理文件内容，返回(markdown_content, txt_content, dialogue_count)
+        处理文件内容，返回(markdown_content, txt_content, dialogue_count, usage, from_cache)
         """
         if progress_callback:
             progress_callback(0.1, "开始翻译...")
@@ -131,7 +430,9 @@ Pete: 你好吗？
             progress_callback(0.3, "正在调用API翻译...")
 
         # 一次性翻译整个文件
-        translated_content = self.translate_entire_file(content, filename)
+        translated_content, usage, from_cache = await self.translate_entire_file(
+            client, content, filename, stream_callback=stream_callback
+        )
 
         if progress_callback:
             progress_callback(0.8, "正在生成格式...")
@@ -143,32 +444,22 @@ Pete: 你好吗？
         if progress_callback:
             progress_callback(1.0, "完成！")
 
-        return md_content, txt_content, dialogue_count
+        return md_content, txt_content, dialogue_count, usage, from_cache
 
     def generate_markdown(self, content: str) -> str:
         """生成Markdown格式"""
-        lines = content.split('\n')
-        md_lines = []
-
-        for line in lines:
-            line = line.strip()
-            if not line:
-                md_lines.append("")
-                continue
-
-            # 如果包含冒号，认为是对话行，加粗说话者
-            if ':' in line:
-                match = re.match(r'^([^:]+):\s*(.*)$', line)
-                if match:
-                    speaker = match.group(1).strip()
-                    text = match.group(2).strip()
-                    md_lines.append(f"**{speaker}:** {text}")
+        def md_lines():
+            for line in content.split('\n'):
+                line = line.strip()
+
+                # 冒号前有说话者时认为是对话行，加粗说话者
+                sep = line.find(':')
+                if sep > 0:
+                    yield f"**{line[:sep].rstrip()}:** {line[sep + 1:].strip()}"
                 else:
-                    md_lines.append(line)
-            else:
-                md_lines.append(line)
+                    yield line
 
-        return '\n'.join(md_lines)
+        return '\n'.join(md_lines())
 
     def generate_txt(self, content: str) -> str:
         """生成纯文本格式"""
@@ -176,25 +467,249 @@ Pete: 你好吗？
         return content
 
 
+class StreamPreview:
+    """流式翻译预览 - 限制刷新频率，只显示最新的内容"""
+
+    def __init__(self, placeholder):
+        self.placeholder = placeholder
+        self.chunks: List[str] = []
+        self.last_render = 0.0
+
+    def __call__(self, delta: str):
+        self.chunks.append(delta)
+        now = time.time()
+        if now - self.last_render >= STREAM_REFRESH_INTERVAL:
+            self.last_render = now
+            self.placeholder.text(''.join(self.chunks)[-STREAM_PREVIEW_CHARS:])
+
+
+async def translate_files(translator: DialogueTranslator, contents: Dict[str, str],
+                          stream_callbacks: Dict[str, StreamPreview], on_done) -> None:
+    """
+    并发翻译所有文件，所有请求共用一个HTTP/2客户端
+    每个文件完成后调用on_done(文件名, 结果, 异常)
+    """
+    async with translator.create_client() as client:
+        async def translate_one(filename: str, content: str):
+            try:
+                result = await translator.process_content(
+                    client, content, filename, stream_callback=stream_callbacks.get(filename)
+                )
+            except Exception as e:
+                on_done(filename, None, e)
+            else:
+                on_done(filename, result, None)
+
+        await asyncio.gather(*(translate_one(filename, content) for filename, content in contents.items()))
+
+
 def create_download_zip(results: Dict[str, Dict]) -> bytes:
     """创建包含所有结果的ZIP文件（包含MD和TXT两种格式）"""
     zip_buffer = BytesIO()
 
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+    # 文本文件很小，用最快的压缩级别即可
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zip_file:
         for filename, data in results.items():
             base_name = Path(filename).stem
 
             # 添加Markdown文件
             md_filename = f"{base_name}_translated.md"
-            zip_file.writestr(md_filename, data['markdown'].encode('utf-8'))
+            zip_file.writestr(md_filename, data['markdown_bytes'])
 
             # 添加TXT文件
             txt_filename = f"{base_name}_translated.txt"
-            zip_file.writestr(txt_filename, data['txt'].encode('utf-8'))
+            zip_file.writestr(txt_filename, data['txt_bytes'])
 
     return zip_buffer.getvalue()
 
 
+# 静态页面内容：每块合并为一次st.markdown，减少每次重新运行时的组件数量
+SIDEBAR_USAGE_MD = f"""
+### 📋 功能说明
+1. 批量上传文件（最多{MAX_FILES}个）
+2. 每个文件整体发送给API
+3. 自动清理 `[tag]` 语气标签
+4. 生成MD和TXT两种格式
+5. 打包下载所有结果
+
+---
+
+### 📝 支持格式
+```
+.txt, .md
+```
+
+---
+
+### 📄 输入格式示例
+```text
+Sally: [warm] Hello!
+Pete: [joyful] Hi there!
+Sally: How are you today?
+```
+
+### 📄 输出格式示例
+```text
+Sally: Hello!
+Sally: 你好！
+
+Pete: Hi there!
+Pete: 嗨，你好！
+
+Sally: How are you today?
+Sally: 你今天怎么样？
+```
+"""
+
+INSTRUCTIONS_FORMAT_MD = """
+### ✅ 支持的格式
+- `.txt` 文本文件
+- `.md` Markdown文件
+
+### 📝 输入格式要求
+每行格式：`说话者: 内容`
+
+示例：
+```
+Sally: [warm] Hello!
+Pete: [joyful] Hi!
+Sally: How are you today?
+```
+"""
+
+INSTRUCTIONS_FEATURES_MD = """
+### 🎯 v3.0 特点
+- 🚀 **终极优化**: 1文件=1请求
+- 📄 **大文件支持**: 20万tokens
+- ⚡ **超快速度**: 比逐句快100倍+
+- 📦 **两种格式**: MD、TXT
+
+### 💡 性能对比
+- **v1.0**: 100行=100次请求
+- **v2.0**: 100行=1次请求（分批）
+- **v3.0**: 整文件=1次请求 🏆
+"""
+
+
+def render_sidebar_info():
+    """渲染侧边栏的静态说明"""
+    st.subheader("🚀 终极优化")
+    st.success("""
+    - ✅ 整个文件一次性翻译
+    - ✅ 10个文件 = 10次API请求
+    - ✅ 支持20万tokens大文件
+    - ✅ 速度提升100倍以上！
+    """)
+
+    st.markdown("---")
+
+    st.subheader("⚙️ 技术规格")
+    st.info(f"""
+    - **模型**: {MODEL_NAME}
+    - **Max Tokens**: {MAX_TOKENS:,}
+    - **最大文件数**: {MAX_FILES}
+    - **请求策略**: 1文件=1请求
+    """)
+
+    st.markdown("---")
+
+    st.markdown(SIDEBAR_USAGE_MD)
+
+
+def render_instructions():
+    """渲染未上传文件时的使用说明"""
+    st.info("👆 请上传要翻译的文件")
+
+    st.markdown("---")
+    st.header("📖 使用说明")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown(INSTRUCTIONS_FORMAT_MD)
+    with col2:
+        st.markdown(INSTRUCTIONS_FEATURES_MD)
+
+
+def render_results(results: Dict[str, Dict], zip_bytes: bytes):
+    """渲染下载和预览区域"""
+    st.markdown("---")
+    st.header("📥 下载结果")
+
+    # 创建下载区域
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.subheader("📦 打包下载（推荐）")
+        st.download_button(
+            label="⬇️ 下载所有文件（ZIP）",
+            data=zip_bytes,
+            file_name="translated_files.zip",
+            mime="application/zip",
+            use_container_width=True
+        )
+        st.info("包含所有的 Markdown 和 TXT 文件")
+
+    with col2:
+        st.subheader("📄 单独下载")
+        selected_file = st.selectbox(
+            "选择文件",
+            options=list(results.keys())
+        )
+
+        if selected_file:
+            result = results[selected_file]
+            base_name = Path(selected_file).stem
+
+            # Markdown下载
+            st.download_button(
+                label="⬇️ 下载 Markdown (.md)",
+                data=result['markdown_bytes'],
+                file_name=f"{base_name}_translated.md",
+                mime="text/markdown",
+                use_container_width=True
+            )
+
+            # TXT下载
+            st.download_button(
+                label="⬇️ 下载 纯文本 (.txt)",
+                data=result['txt_bytes'],
+                file_name=f"{base_name}_translated.txt",
+                mime="text/plain",
+                use_container_width=True
+            )
+
+    # 预览区域
+    st.markdown("---")
+    st.header("👀 预览翻译结果")
+
+    preview_file = st.selectbox(
+        "选择要预览的文件",
+        options=list(results.keys()),
+        key="preview_select"
+    )
+
+    if preview_file:
+        result = results[preview_file]
+
+        tab1, tab2 = st.tabs(["📝 TXT预览", "📄 Markdown预览"])
+
+        with tab1:
+            st.text_area(
+                "纯文本内容",
+                value=result['txt'],
+                height=400,
+                disabled=True
+            )
+
+        with tab2:
+            st.text_area(
+                "Markdown内容",
+                value=result['markdown'],
+                height=400,
+                disabled=True
+            )
+
+
 def main():
     """主函数"""
     st.title("🌍 对话翻译工具 v3.0")
@@ -215,56 +730,38 @@ def main():
 
         st.markdown("---")
 
-        st.subheader("🚀 终极优化")
-        st.success("""
-        - ✅ 整个文件一次性翻译
-        - ✅ 10个文件 = 10次API请求
-        - ✅ 支持20万tokens大文件
-        - ✅ 速度提升100倍以上！
-        """)
+        st.subheader("🗄️ 翻译缓存")
+        cache = get_translation_cache()
 
-        st.markdown("---")
-
-        st.subheader("⚙️ 技术规格")
-        st.info(f"""
-        - **模型**: {MODEL_NAME}
-        - **Max Tokens**: {MAX_TOKENS:,}
-        - **最大文件数**: {MAX_FILES}
-        - **请求策略**: 1文件=1请求
-        """)
-
-        st.markdown("---")
-
-        st.subheader("📋 功能说明")
-        st.markdown(f"""
-        1. 批量上传文件（最多{MAX_FILES}个）
-        2. 每个文件整体发送给API
-        3. 自动清理 `[tag]` 语气标签
-        4. 生成MD和TXT两种格式
-        5. 打包下载所有结果
-        """)
-
-        st.markdown("---")
-
-        st.subheader("📝 支持格式")
-        st.code(".txt, .md")
+        if SEMANTIC_CACHE_AVAILABLE:
+            use_semantic_cache = st.checkbox(
+                "启用语义缓存",
+                help=f"内容相近的文件直接复用已有翻译。仅在当前会话内生效，最多保留{SEMANTIC_MAX_ENTRIES}条（首次启用需下载嵌入模型）"
+            )
+            semantic_threshold = st.slider(
+                "相似度阈值",
+                min_value=0.80,
+                max_value=1.00,
+                value=SEMANTIC_THRESHOLD,
+                step=0.01,
+                disabled=not use_semantic_cache
+            )
+        else:
+            use_semantic_cache = False
+            semantic_threshold = SEMANTIC_THRESHOLD
+            st.caption("安装 fastembed 和 faiss-cpu 后可启用语义缓存")
+
+        if st.button("🧹 清空缓存", use_container_width=True):
+            cache.clear()
+            # 无论当前是否勾选都要清空，避免重新启用后命中旧结果
+            if SEMANTIC_CACHE_AVAILABLE:
+                get_semantic_cache().clear()
+            st.success("✅ 缓存已清空")
+        st.caption(f"已缓存 {len(cache)} 个翻译结果，相同文件再次翻译将直接返回")
 
         st.markdown("---")
 
-        st.subheader("📄 输入格式示例")
-        st.code("""Sally: [warm] Hello!
-Pete: [joyful] Hi there!
-Sally: How are you today?""", language="text")
-
-        st.subheader("📄 输出格式示例")
-        st.code("""Sally: Hello!
-Sally: 你好！
-
-Pete: Hi there!
-Pete: 嗨，你好！
-
-Sally: How are you today?
-Sally: 你今天怎么样？""", language="text")
+        render_sidebar_info()
 
     # 主内容区
     if not api_key:
@@ -292,77 +789,112 @@ Sally: 你今天怎么样？""", language="text")
 
         # 显示文件列表
         with st.expander("📋 文件列表", expanded=True):
+            rows = []
             total_size = 0
             for idx, file in enumerate(uploaded_files, 1):
-                file_size = len(file.getvalue()) / 1024  # KB
+                file_size = file.size / 1024  # KB（直接读取大小，无需复制文件内容）
                 total_size += file_size
 
-                # 估算tokens数量（粗略估算：1KB ≈ 200 tokens）
-                estimated_tokens = int(file_size * 200)
-                token_status = "✅" if estimated_tokens < MAX_TOKENS else "⚠️"
+                # 与翻译前的超长检查使用同一估算（字节数≥字符数，这里只会偏保守）
+                estimated_tokens = estimate_tokens(file.size)
+                rows.append({
+                    "序号": idx,
+                    "文件名": file.name,
+                    "大小 (KB)": round(file_size, 2),
+                    "预估tokens": estimated_tokens,
+                    "状态": "✅" if estimated_tokens <= MAX_TOKENS else "⚠️"
+                })
 
-                st.write(f"{idx}. **{file.name}** ({file_size:.2f} KB, ~{estimated_tokens:,} tokens) {token_status}")
+            # 一次性渲染整张表，避免每个文件单独发送一个组件
+            st.dataframe(rows, use_container_width=True, hide_index=True)
 
             st.write(f"**总大小**: {total_size:.2f} KB")
 
         st.markdown("---")
 
+        # 上传的文件变化后不再显示旧结果（重新上传同名同大小的文件也会得到新的file_id）
+        file_key = tuple(file.file_id for file in uploaded_files)
+
         # 开始翻译按钮
         if st.button("🚀 开始翻译", type="primary", use_container_width=True):
             # 创建翻译器
-            translator = DialogueTranslator(api_key, MODEL_NAME)
+            translator = DialogueTranslator(
+                api_key,
+                MODEL_NAME,
+                cache=get_translation_cache(),
+                semantic_cache=get_semantic_cache() if use_semantic_cache else None,
+                semantic_threshold=semantic_threshold
+            )
 
             # 进度显示
             st.header("🔄 翻译进度")
-            st.info(f"📊 将发送 {len(uploaded_files)} 次API请求（每个文件一次）")
+            st.info("📊 每个文件最多发送1次API请求，命中缓存的文件不会请求API")
 
             # 存储结果
             results = {}
-            success_count = 0
-            total_dialogue_count = 0
 
             # 开始计时
             start_time = time.time()
 
-            # 处理每个文件
-            for idx, uploaded_file in enumerate(uploaded_files, 1):
-                with st.expander(f"📄 {idx}/{len(uploaded_files)}: {uploaded_file.name}", expanded=True):
-                    try:
-                        # 读取文件内容
-                        content = uploaded_file.getvalue().decode('utf-8')
-
-                        st.info(f"📖 正在翻译: {uploaded_file.name}")
-                        st.write(f"🔄 发送第 {idx} 次API请求...")
-
-                        # 创建进度条
-                        progress_bar = st.progress(0)
-                        progress_text = st.empty()
-
-                        def update_progress(progress, message):
-                            progress_bar.progress(progress)
-                            progress_text.text(message)
-
-                        # 处理文件（一次性翻译）
-                        md_content, txt_content, dialogue_count = translator.process_content(
-                            content,
-                            uploaded_file.name,
-                            progress_callback=update_progress
-                        )
-
-                        # 存储结果
-                        results[uploaded_file.name] = {
-                            'markdown': md_content,
-                            'txt': txt_content,
-                            'dialogue_count': dialogue_count
-                        }
+            # 预先读取所有文件内容
+            contents = {}
+            for uploaded_file in uploaded_files:
+                try:
+                    contents[uploaded_file.name] = uploaded_file.getvalue().decode('utf-8')
+                except Exception as e:
+                    st.error(f"❌ 处理失败: {uploaded_file.name} - {str(e)}")
+
+            # 每个文件一个区域：状态 + 流式翻译预览
+            file_areas = {}
+            for idx, filename in enumerate(contents, 1):
+                with st.expander(f"📄 {idx}/{len(contents)}: {filename}", expanded=True):
+                    status = st.empty()
+                    status.info(f"📖 正在翻译: {filename}")
+                    file_areas[filename] = (status, st.empty())
+
+            # 总进度条（按已完成文件数推进）
+            progress_bar = st.progress(0)
+            progress_text = st.empty()
+            progress_text.text(f"🔄 正在并发翻译 {len(contents)} 个文件...")
+
+            finished = []
+
+            def on_file_done(filename, result, error):
+                finished.append(filename)
+                status, preview = file_areas[filename]
+                preview.empty()
+
+                if error is None:
+                    md_content, txt_content, dialogue_count, usage, from_cache = result
+
+                    # 存储结果（只编码一次，下载按钮和ZIP共用）
+                    results[filename] = {
+                        'markdown': md_content,
+                        'txt': txt_content,
+                        'markdown_bytes': md_content.encode('utf-8'),
+                        'txt_bytes': txt_content.encode('utf-8'),
+                        'dialogue_count': dialogue_count,
+                        'usage': usage,
+                        'from_cache': from_cache
+                    }
+
+                    source = "（来自缓存）" if from_cache else ""
+                    status.success(f"✅ 完成翻译{source}: {filename} ({dialogue_count} 行对话)")
+                else:
+                    status.error(f"❌ 处理失败: {filename} - {str(error)}")
 
-                        success_count += 1
-                        total_dialogue_count += dialogue_count
+                progress_bar.progress(len(finished) / len(contents))
+                progress_text.text(f"✅ 已完成 {len(finished)}/{len(contents)} 个文件")
 
-                        st.success(f"✅ 完成翻译: {uploaded_file.name} ({dialogue_count} 行对话)")
+            # 并发处理所有文件（所有请求共用一个HTTP/2连接）
+            stream_previews = {filename: StreamPreview(preview) for filename, (_, preview) in file_areas.items()}
+            asyncio.run(translate_files(translator, contents, stream_previews, on_file_done))
 
-                    except Exception as e:
-                        st.error(f"❌ 处理失败: {uploaded_file.name} - {str(e)}")
+            # 按上传顺序整理结果
+            results = {name: results[name] for name in contents if name in results}
+            success_count = len(results)
+            api_request_count = sum(1 for result in results.values() if not result['from_cache'])
+            total_dialogue_count = sum(result['dialogue_count'] for result in results.values())
 
             # 统计结果
             elapsed_time = time.time() - start_time
@@ -376,7 +908,7 @@ Sally: 你今天怎么样？""", language="text")
             with col2:
                 st.metric("成功处理", success_count)
             with col3:
-                st.metric("API请求数", success_count)
+                st.metric("API请求数", api_request_count)
             with col4:
                 st.metric("总耗时", f"{elapsed_time:.1f}秒")
 
@@ -385,130 +917,30 @@ Sally: 你今天怎么样？""", language="text")
                 avg_time = elapsed_time / success_count
                 st.info(f"⚡ 平均每个文件耗时: {avg_time:.1f}秒 | 总对话行数: {total_dialogue_count}")
 
-            if results:
-                st.markdown("---")
-                st.header("📥 下载结果")
-
-                # 创建下载区域
-                col1, col2 = st.columns(2)
-
-                with col1:
-                    st.subheader("📦 打包下载（推荐）")
-                    zip_bytes = create_download_zip(results)
-                    st.download_button(
-                        label="⬇️ 下载所有文件（ZIP）",
-                        data=zip_bytes,
-                        file_name="translated_files.zip",
-                        mime="application/zip",
-                        use_container_width=True
-                    )
-                    st.info("包含所有的 Markdown 和 TXT 文件")
-
-                with col2:
-                    st.subheader("📄 单独下载")
-                    selected_file = st.selectbox(
-                        "选择文件",
-                        options=list(results.keys())
-                    )
-
-                    if selected_file:
-                        result = results[selected_file]
-                        base_name = Path(selected_file).stem
-
-                        # Markdown下载
-                        st.download_button(
-                            label="⬇️ 下载 Markdown (.md)",
-                            data=result['markdown'],
-                            file_name=f"{base_name}_translated.md",
-                            mime="text/markdown",
-                            use_container_width=True
-                        )
-
-                        # TXT下载
-                        st.download_button(
-                            label="⬇️ 下载 纯文本 (.txt)",
-                            data=result['txt'],
-                            file_name=f"{base_name}_translated.txt",
-                            mime="text/plain",
-                            use_container_width=True
-                        )
-
-                # 预览区域
-                st.markdown("---")
-                st.header("👀 预览翻译结果")
-
-                preview_file = st.selectbox(
-                    "选择要预览的文件",
-                    options=list(results.keys()),
-                    key="preview_select"
-                )
-
-                if preview_file:
-                    result = results[preview_file]
+            # 实际token用量（缓存命中的文件没有用量）
+            usages = [result['usage'] for result in results.values() if result['usage']]
+            if usages:
+                prompt_tokens = sum(usage.get('prompt_tokens', 0) for usage in usages)
+                completion_tokens = sum(usage.get('completion_tokens', 0) for usage in usages)
+                st.info(f"🔢 Token用量: 输入 {prompt_tokens:,} | 输出 {completion_tokens:,}")
 
-                    tab1, tab2 = st.tabs(["📝 TXT预览", "📄 Markdown预览"])
-
-                    with tab1:
-                        st.text_area(
-                            "纯文本内容",
-                            value=result['txt'],
-                            height=400,
-                            disabled=True
-                        )
-
-                    with tab2:
-                        st.text_area(
-                            "Markdown内容",
-                            value=result['markdown'],
-                            height=400,
-                            disabled=True
-                        )
+            # 保存本批结果，切换下拉框等操作重新运行时仍可下载，ZIP也只打包一次
+            st.session_state['translation_batch'] = {
+                'file_key': file_key,
+                'results': results,
+                'zip_bytes': create_download_zip(results) if results else None
+            }
 
             st.success("🎉 所有任务完成！")
 
+        # 显示当前这批文件最近一次的翻译结果
+        batch = st.session_state.get('translation_batch')
+        if batch and batch['file_key'] == file_key and batch['results']:
+            render_results(batch['results'], batch['zip_bytes'])
+
     else:
         # 显示使用提示
-        st.info("👆 请上传要翻译的文件")
-
-        st.markdown("---")
-        st.header("📖 使用说明")
-
-        col1, col2 = st.columns(2)
-
-        with col1:
-            st.subheader("✅ 支持的格式")
-            st.markdown("""
-            - `.txt` 文本文件
-            - `.md` Markdown文件
-            """)
-
-            st.subheader("📝 输入格式要求")
-            st.markdown("""
-            每行格式：`说话者: 内容`
-
-            示例：
-            ```
-            Sally: [warm] Hello!
-            Pete: [joyful] Hi!
-            Sally: How are you today?
-            ```
-            """)
-
-        with col2:
-            st.subheader("🎯 v3.0 特点")
-            st.markdown("""
-            - 🚀 **终极优化**: 1文件=1请求
-            - 📄 **大文件支持**: 20万tokens
-            - ⚡ **超快速度**: 比逐句快100倍+
-            - 📦 **两种格式**: MD、TXT
-            """)
-
-            st.subheader("💡 性能对比")
-            st.markdown("""
-            - **v1.0**: 100行=100次请求
-            - **v2.0**: 100行=1次请求（分批）
-            - **v3.0**: 整文件=1次请求 🏆
-            """)
+        render_instructions()
 
 
 if __name__ == "__main__":